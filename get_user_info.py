@@ -1,6 +1,9 @@
+import json
+import mmap
 import os
 import re
-from typing import Optional, Dict, Iterable, Tuple
+from bisect import bisect_left, bisect_right
+from typing import Optional, Dict, Iterable, List, Tuple
 
 # Regex correspond aux deux formes :
 # [timestamp][LEVEL][username] action
@@ -44,6 +47,147 @@ def _iter_decoded_lines(path: str) -> Iterable[str]:
     for line in text.splitlines():
         yield line
 
+# Index creux timestamp -> position en octets, stocké à côté du fichier de log (logs.txt.idx).
+# Une entrée est enregistrée environ tous les INDEX_STRIDE octets, au début de la première
+# ligne horodatée qui suit. Les timestamps du serveur étant croissants, une recherche
+# dichotomique dans l'index donne directement la plage d'octets à lire pour une fenêtre de temps.
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+INDEX_STRIDE = 64 * 1024
+TIMESTAMP_PATTERN = re.compile(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]")
+TIMESTAMP_LENGTH = len("[2025-09-04 20:23:04]")
+
+def _detect_encoding(head: bytes) -> Tuple[str, int, bytes, int]:
+    """Détecte l'encodage à partir du BOM.
+
+    Retourne (encodage, taille du BOM, octets de fin de ligne, taille d'une unité de code).
+    """
+    if head.startswith(b'\xff\xfe'):
+        return 'utf-16-le', 2, b'\n\x00', 2
+    if head.startswith(b'\xfe\xff'):
+        return 'utf-16-be', 2, b'\x00\n', 2
+    if head.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8', 3, b'\n', 1
+    return 'utf-8', 0, b'\n', 1
+
+def _next_line_start(mm: mmap.mmap, pos: int, base: int, newline: bytes, unit: int) -> int:
+    """Position du début de la ligne suivant pos (ou la fin du fichier).
+
+    base est le début des données (après le BOM) : en UTF-16 un saut de ligne doit
+    être aligné sur une unité de code de 2 octets.
+    """
+    idx = mm.find(newline, pos)
+    while idx != -1 and (idx - base) % unit:
+        idx = mm.find(newline, idx + 1)
+    return len(mm) if idx == -1 else idx + len(newline)
+
+def _line_timestamp(mm: mmap.mmap, pos: int, encoding: str, unit: int) -> Optional[str]:
+    """Timestamp de la ligne commençant à pos, en ne décodant que son préfixe."""
+    head = mm[pos:pos + TIMESTAMP_LENGTH * unit].decode(encoding, errors='ignore')
+    match = TIMESTAMP_PATTERN.match(head)
+    return match.group(1) if match else None
+
+def _index_path(log_file_path: str) -> str:
+    return log_file_path + INDEX_SUFFIX
+
+def build_index(log_file_path: str, stride: int = INDEX_STRIDE) -> Dict:
+    """Construit l'index creux d'un fichier de log et l'écrit dans le fichier annexe .idx."""
+    stat = os.stat(log_file_path)
+    index = {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'encoding': 'utf-8', 'bom': 0, 'entries': []}
+    if stat.st_size:
+        with open(log_file_path, 'rb') as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            encoding, bom, newline, unit = _detect_encoding(mm[:4])
+            index['encoding'] = encoding
+            index['bom'] = bom
+            entries: List[List] = index['entries']
+            pos = bom
+            while pos < len(mm):
+                timestamp = _line_timestamp(mm, pos, encoding, unit)
+                if timestamp is None:
+                    pos = _next_line_start(mm, pos, bom, newline, unit)
+                    continue
+                entries.append([timestamp, pos])
+                # Saute directement à la première ligne après pos + stride
+                skip_to = pos + stride
+                skip_to -= (skip_to - bom) % unit
+                if skip_to >= len(mm):
+                    break
+                pos = _next_line_start(mm, skip_to, bom, newline, unit)
+    index['saved'] = save_index(log_file_path, index)
+    return index
+
+def save_index(log_file_path: str, index: Dict) -> bool:
+    """Écrit l'index à côté du log. Retourne False si le dossier n'est pas accessible en écriture :
+    l'index reste alors utilisable en mémoire, il sera simplement reconstruit au prochain appel."""
+    try:
+        with open(_index_path(log_file_path), 'w', encoding='utf-8') as out:
+            json.dump({key: value for key, value in index.items() if key != 'saved'}, out)
+    except OSError:
+        return False
+    return True
+
+def load_index(log_file_path: str) -> Optional[Dict]:
+    """Charge l'index annexe s'il existe et correspond toujours au fichier de log."""
+    try:
+        with open(_index_path(log_file_path), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(log_file_path)
+    if index.get('version') != INDEX_VERSION or index.get('size') != stat.st_size or index.get('mtime') != stat.st_mtime:
+        return None
+    return index
+
+def get_index(log_file_path: str) -> Dict:
+    """Retourne l'index du fichier, en le (re)construisant s'il est absent ou périmé."""
+    return load_index(log_file_path) or build_index(log_file_path)
+
+def _normalize_bound(value: str, upper: bool, index: Dict) -> str:
+    """Convertit une borne --since/--until au format des timestamps du log.
+
+    Formats acceptés : 'AAAA-MM-JJ HH:MM[:SS]', 'AAAA-MM-JJ' ou 'HH:MM[:SS]'. Sans date,
+    on utilise la date de la première entrée du log. Les champs omis sont complétés
+    pour que la borne soit inclusive (20:28 en borne haute couvre jusqu'à 20:28:59).
+    """
+    value = value.strip().replace('T', ' ')
+    if re.fullmatch(r"\d{2}:\d{2}(:\d{2})?", value):
+        if not index['entries']:
+            raise ValueError(f"Impossible de dater '{value}' : le log ne contient aucun timestamp")
+        value = index['entries'][0][0][:10] + ' ' + value
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        value += ' 23:59:59' if upper else ' 00:00:00'
+    elif re.fullmatch(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}", value):
+        value += ':59' if upper else ':00'
+    elif not re.fullmatch(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}", value):
+        raise ValueError(f"Format de date invalide : '{value}'")
+    return value
+
+def _iter_indexed_lines(log_file_path: str, index: Dict, since: Optional[str], until: Optional[str]) -> Iterable[str]:
+    """Génère les lignes pouvant appartenir à la fenêtre [since, until] en ne lisant que la plage d'octets utile.
+
+    Les lignes en bordure de plage peuvent être hors de la fenêtre : l'appelant filtre sur le timestamp.
+    """
+    if not index['size']:
+        return
+    entries = index['entries']
+    timestamps = [entry[0] for entry in entries]
+    start = index['bom']
+    end = index['size']
+    if since:
+        # Dernière entrée strictement avant since : toutes les lignes précédentes sont hors fenêtre
+        i = bisect_left(timestamps, since) - 1
+        if i >= 0:
+            start = entries[i][1]
+    if until:
+        # Première entrée strictement après until : toutes les lignes suivantes sont hors fenêtre
+        j = bisect_right(timestamps, until)
+        if j < len(entries):
+            end = entries[j][1]
+    with open(log_file_path, 'rb') as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(index['encoding'], errors='ignore')
+    for line in text.splitlines():
+        yield line
+
 def _normalize_endpoint(path: str) -> str:
         """Normalise l'endpoint en remplaçant les segments d'ID numériques par :id.
         Exemples :
@@ -56,13 +200,39 @@ def _normalize_endpoint(path: str) -> str:
                 return path
         return re.sub(r"/(?:\d+)(?=$|/)", "/:id", path)
 
-def analyze_logs(log_file_path: str, include_system: bool = False, build_markov: bool = False, infer_login: bool = False):
+def analyze_logs(log_file_path: str, include_system: bool = False, build_markov: bool = False, infer_login: bool = False,
+                 since: Optional[str] = None, until: Optional[str] = None, user: Optional[str] = None):
     """Analyse le fichier de log et retourne les statistiques.
 
     include_system : inclure ou non les lignes sans nom d'utilisateur explicite (messages de démarrage) sous l'utilisateur synthétique 'system'.
     build_markov : construire une chaîne de Markov des transitions entre endpoints normalisés.
     infer_login : tenter d'inférer le succès des tentatives de connexion anonymes basées sur l'apparition ultérieure de nouveaux utilisateurs.
+    since / until : ne garder que les lignes dans cette fenêtre de temps (bornes incluses). Utilise l'index .idx pour ne lire que la plage utile du fichier.
+    user : ne garder que les lignes de cet utilisateur. C'est un simple filtre sur les lignes lues : seules
+        since / until utilisent l'index, user seul parcourt donc tout le fichier.
     """
+    index = None
+    if since or until:
+        index = get_index(log_file_path)
+        since = _normalize_bound(since, False, index) if since else None
+        until = _normalize_bound(until, True, index) if until else None
+
+    def select_lines() -> Iterable[str]:
+        if index is not None:
+            return _iter_indexed_lines(log_file_path, index, since, until)
+        return _iter_decoded_lines(log_file_path)
+
+    def keep(parsed: Dict[str, str]) -> bool:
+        if parsed['username'] == 'system' and not include_system:
+            return False
+        if user and parsed['username'] != user:
+            return False
+        if since and parsed['timestamp'] < since:
+            return False
+        if until and parsed['timestamp'] > until:
+            return False
+        return True
+
     users: Dict[str, list] = {}
     actions: Dict[str, int] = {}
     endpoint_counts: Dict[str, int] = {}
@@ -73,14 +243,14 @@ def analyze_logs(log_file_path: str, include_system: bool = False, build_markov:
     seen_users: set[str] = set()
     line_index = 0
 
-    for raw_line in _iter_decoded_lines(log_file_path):
+    for raw_line in select_lines():
             parsed = parse_log_line(raw_line)
             if not parsed:
                 continue
 
             username = parsed['username']
-            # Ignore les lignes système sauf si demandé
-            if username == 'system' and not include_system:
+            # Ignore les lignes système sauf si demandé, et celles hors des filtres
+            if not keep(parsed):
                 continue
 
             # Donne la méthode (premier token) de l'action, par défaut 'UNKNOWN'
@@ -114,12 +284,12 @@ def analyze_logs(log_file_path: str, include_system: bool = False, build_markov:
         # Construit les transitions par utilisateur pour éviter de mélanger les parcours
         user_sequences: Dict[str, list] = {}
         line_idx = 0
-        for raw_line in _iter_decoded_lines(log_file_path):
+        for raw_line in select_lines():
             parsed = parse_log_line(raw_line)
             if not parsed:
                 continue
             username = parsed['username']
-            if username == 'system' and not include_system:
+            if not keep(parsed):
                 continue
             verb = parsed['action'].split()[0] if parsed['action'] else 'UNKNOWN'
             parts = parsed['action'].split()
@@ -155,6 +325,9 @@ def analyze_logs(log_file_path: str, include_system: bool = False, build_markov:
         'actions': actions,
         'total_logs': sum(actions.values()),
         'include_system': include_system,
+        'since': since,
+        'until': until,
+        'user': user,
         'endpoints': endpoint_counts,
         'transitions': transitions,
         'transition_percentages': transition_probs,
@@ -165,7 +338,13 @@ def analyze_logs(log_file_path: str, include_system: bool = False, build_markov:
 
 def print_statistics(stats: Dict[str, Dict], show_markov: bool = False, show_login: bool = False):
     """Affiche les statistiques formatées"""
-
+    if stats.get('since') or stats.get('until') or stats.get('user'):
+        print("Filtres:")
+        if stats.get('since') or stats.get('until'):
+            print(f"  Fenêtre: {stats.get('since') or 'début'} -> {stats.get('until') or 'fin'}")
+        if stats.get('user'):
+            print(f"  Utilisateur: {stats['user']}")
+        print(f"  Lignes retenues: {stats['total_logs']}")
 
     # Résumé des endpoints
     if stats.get('endpoints'):
@@ -198,15 +377,31 @@ if __name__ == "__main__":
     parser.add_argument("--include-system", action="store_true", help="Include system/server lines without username")
     parser.add_argument("--markov", action="store_true", help="Compute and display Markov chain transitions between endpoints (ID-normalized)")
     parser.add_argument("--login-results", action="store_true", help="Infer success of anonymous POST /login attempts based on subsequent new user appearances")
+    parser.add_argument("--since", help="Only keep lines at or after this time ('YYYY-MM-DD HH:MM[:SS]', 'YYYY-MM-DD' or 'HH:MM[:SS]')")
+    parser.add_argument("--until", help="Only keep lines at or before this time (same formats as --since)")
+    parser.add_argument("--user", help="Only keep lines of this username (a plain filter: without --since/--until the whole file is still read)")
+    parser.add_argument("--build-index", action="store_true", help="(Re)build the timestamp index sidecar file (<file>.idx) and exit")
     args = parser.parse_args()
 
-    if os.path.exists(args.file):
-        stats = analyze_logs(
-            args.file,
-            include_system=args.include_system,
-            build_markov=args.markov,
-            infer_login=args.login_results
-        )
-        print_statistics(stats, show_markov=args.markov, show_login=args.login_results)
+    if not os.path.exists(args.file):
+        print(f"Log file '{args.file}' not found.")
+    elif args.build_index:
+        index = build_index(args.file)
+        if index['saved']:
+            print(f"Index written to '{_index_path(args.file)}' ({len(index['entries'])} entries).")
+        else:
+            print(f"Could not write the index to '{_index_path(args.file)}' ({len(index['entries'])} entries).")
     else:
-        print(f"Log file '{args.file}' not found.")
\ No newline at end of file
+        try:
+            stats = analyze_logs(
+                args.file,
+                include_system=args.include_system,
+                build_markov=args.markov,
+                infer_login=args.login_results,
+                since=args.since,
+                until=args.until,
+                user=args.user
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        print_statistics(stats, show_markov=args.markov, show_login=args.login_results)
@@ -0,0 +1,152 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import executor
+import metrics
+
+# Admission control for the API layer.
+#
+# Two checks run before a request reaches its handler:
+# - a token bucket per client (429 when the client is over its rate). A
+#   client is the user of a valid bearer token, or the remote address for
+#   anonymous requests and unknown tokens, so neither /login attempts nor
+#   made-up tokens escape the limit,
+# - a concurrency limit per executor lane. Endpoint groups that run their
+#   store work on a lane share one limit equal to the lane's worker count, so
+#   an admitted request always finds a free worker and never waits in the
+#   (unbounded) executor queue. A request that finds its lane full waits for
+#   a slot for at most MAX_QUEUE_SECONDS, then is shed with a 503. Shedding on
+#   queue time rather than queue length keeps the latency of the admitted
+#   requests bounded when the server is saturated.
+#
+# Everything runs on the event loop, so no locking is needed.
+
+ENABLED = os.environ.get("ADMISSION_ENABLED", "0") == "1"
+RATE_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", "20"))
+RATE_BURST = float(os.environ.get("RATE_LIMIT_BURST", "40"))
+MAX_QUEUE_SECONDS = float(os.environ.get("ADMISSION_MAX_QUEUE_MS", "200")) / 1000
+
+# Executor lane used by each endpoint group (first path segment), see the
+# executor.run calls in main.py. Each lane is limited to its worker count.
+ENDPOINT_LANES: Dict[str, str] = {
+    "/feed": "heavy",
+    "/profile": "heavy",
+    "/search": "heavy",
+    "/batch": "heavy",
+    "/post": "light",
+    "/like": "light",
+    "/follow": "light",
+    "/trending": "light",
+}
+# Groups without store work (login, ...) are only limited by this
+DEFAULT_LIMIT = 128
+
+# Never limited: monitoring and documentation
+EXEMPT_PATHS = {"/metrics", "/docs", "/redoc", "/openapi.json"}
+# Rate limited only: long-lived streams would hold a concurrency slot while
+# idle, their number is capped per user by live.MAX_STREAMS_PER_USER instead
+STREAM_PATHS = {"/feed/stream"}
+
+# Buckets kept, least recently used are dropped first. A dropped client
+# simply starts again from a full bucket.
+MAX_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take one token. Returns 0 on success, else the seconds until a token is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ConcurrencyLimit:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.semaphore.locked():
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+
+class Rejection:
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    def __init__(self):
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.limits: Dict[str, ConcurrencyLimit] = {}
+
+    @staticmethod
+    def endpoint_group(path: str) -> str:
+        segment = path.split("/", 2)[1] if path.startswith("/") else path
+        return "/" + segment
+
+    def check_rate(self, identity: str) -> Optional[Rejection]:
+        now = time.monotonic()
+        bucket = self.buckets.get(identity)
+        if bucket is None:
+            bucket = self.buckets[identity] = TokenBucket(RATE_PER_SECOND, RATE_BURST, now)
+            if len(self.buckets) > MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(identity)
+        wait = bucket.take(now)
+        if wait:
+            return Rejection(429, "Too many requests", wait)
+        return None
+
+    async def acquire(self, group: str) -> Tuple[Optional[ConcurrencyLimit], Optional[Rejection]]:
+        lane = ENDPOINT_LANES.get(group)
+        key = f"lane:{lane}" if lane else group
+        limit = self.limits.get(key)
+        if limit is None:
+            size = executor.LANE_LIMITS[lane] if lane else DEFAULT_LIMIT
+            limit = self.limits[key] = ConcurrencyLimit(size)
+        if not await limit.acquire(MAX_QUEUE_SECONDS):
+            return None, Rejection(503, "Server overloaded, try again later", MAX_QUEUE_SECONDS)
+        return limit, None
+
+    def queue_depths(self, field: str) -> Dict[tuple, int]:
+        return {(("limit", key),): getattr(limit, field) for key, limit in self.limits.items()}
+
+
+controller = AdmissionController()
+
+rejections = metrics.register(metrics.Counter("admission_rejected_total", "Requests rejected by admission control, by reason and endpoint group."))
+metrics.register_gauge("admission_waiting", "Requests waiting for a concurrency slot, by lane or endpoint group.", lambda: controller.queue_depths("waiting"))
+metrics.register_gauge("admission_in_flight", "Admitted requests in progress, by lane or endpoint group.", lambda: controller.queue_depths("in_flight"))
@@ -0,0 +1,55 @@
+import argparse
+import random
+import time
+
+import trending
+
+# Benchmark of the trending leaderboard under a hot-key like storm: most likes
+# hit a handful of posts while the rest are spread over a large catalog, and
+# the top-N is read regularly. Runs on the Leaderboard directly, since through
+# the API likes are deduplicated per (user, post) and would stop reaching it.
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(posts: int, likes: int, hot_posts: int, hot_fraction: float, read_every: int, top: int, seed: int):
+    rng = random.Random(seed)
+    leaderboard = trending.Leaderboard()
+    for post_id in range(1, posts + 1):
+        leaderboard.record_post(post_id)
+
+    hot = list(range(1, hot_posts + 1))
+    like_times = []
+    read_times = []
+    start = time.perf_counter()
+    for i in range(likes):
+        post_id = rng.choice(hot) if rng.random() < hot_fraction else rng.randint(1, posts)
+        t = time.perf_counter()
+        leaderboard.record_like(post_id)
+        like_times.append(time.perf_counter() - t)
+        if i % read_every == 0:
+            t = time.perf_counter()
+            leaderboard.top_ids(top)
+            read_times.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+
+    print(f"{likes} likes on {posts} posts ({hot_fraction:.0%} on {hot_posts} hot posts) in {total:.2f}s")
+    print(f"  record_like: p50={percentile(like_times, 0.5) * 1e6:.1f}us p99={percentile(like_times, 0.99) * 1e6:.1f}us")
+    print(f"  top_ids({top}): p50={percentile(read_times, 0.5) * 1e6:.1f}us p99={percentile(read_times, 0.99) * 1e6:.1f}us")
+    print(f"  top 5: {leaderboard.top_ids(5)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the trending leaderboard under a hot-key like storm.")
+    parser.add_argument("--posts", type=int, default=100000, help="Number of posts (default: 100000)")
+    parser.add_argument("--likes", type=int, default=500000, help="Number of likes (default: 500000)")
+    parser.add_argument("--hot-posts", type=int, default=5, help="Number of hot posts (default: 5)")
+    parser.add_argument("--hot-fraction", type=float, default=0.9, help="Fraction of likes on the hot posts (default: 0.9)")
+    parser.add_argument("--read-every", type=int, default=100, help="Read the top-N every this many likes (default: 100)")
+    parser.add_argument("--top", type=int, default=20, help="N for the top-N reads (default: 20)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.posts, args.likes, args.hot_posts, args.hot_fraction, args.read_every, args.top, args.seed)
@@ -1,6 +1,11 @@
 from datetime import datetime
 from typing import List, Dict, Set, Optional
+import threading
 import models
+import metrics
+import search
+import trending
+import sharding
 
 # In-memory database
 users: Dict[int, models.User] = {}
@@ -14,6 +19,24 @@ username_to_id: Dict[str, int] = {}  # username -> user_id
 user_id_counter = 1
 post_id_counter = 1
 
+# Store operations run on worker threads (see executor.py), so every mutation
+# goes through this lock. Readers iterate over list() snapshots instead of
+# taking the lock, so a long get_feed never blocks writers.
+#
+# When sharding is enabled, follows and likes live in the shards only. A write
+# reserves its ids under the lock, releases it for the shard round-trip, then
+# takes it again to update the local collections: the lock is never held
+# across IPC, and a failed shard write leaves nothing to undo locally.
+write_lock = threading.RLock()
+
+# Running totals of the follow edges and likes, kept under write_lock so
+# that /metrics never has to walk every set
+follow_edge_count = 0
+like_count = 0
+
+# Optional partitioned social graph, see enable_sharding()
+graph: Optional[sharding.ShardedGraph] = None
+
 # Initialize with some sample data
 def init_db():
     global user_id_counter, post_id_counter
@@ -82,23 +105,36 @@ def init_db():
     follow_user(10, 6) # playful_otter follows energetic_fox
 
 # User operations
+@metrics.timed("create_user")
 def create_user(user_create: models.UserCreate) -> models.User:
     global user_id_counter
     
-    user = models.User(
-        id=user_id_counter,
-        username=user_create.username,
-        email=user_create.email,
-        created_at=datetime.now()
-    )
-    
+    with write_lock:
+        user = models.User(
+            id=user_id_counter,
+            username=user_create.username,
+            email=user_create.email,
+            created_at=datetime.now()
+        )
+        user_id_counter += 1
+        shards = graph
+        if shards is None:
+            _store_user(user, user_create.password)
+            return user
+
+    # The user only becomes visible once its shard knows it
+    shards.add_user(user.id)
+    with write_lock:
+        _store_user(user, user_create.password)
+    return user
+
+def _store_user(user: models.User, password: str):
+    # Called with write_lock held
+    if graph is None:
+        follows[user.id] = set()  # Initialize empty set of follows
     users[user.id] = user
-    follows[user.id] = set()  # Initialize empty set of follows
-    user_credentials[user.username] = user_create.password
+    user_credentials[user.username] = password
     username_to_id[user.username] = user.id
-    
-    user_id_counter += 1
-    return user
 
 def get_user(user_id: int) -> Optional[models.User]:
     return users.get(user_id)
@@ -109,28 +145,88 @@ def get_user_by_username(username: str) -> Optional[models.User]:
         return users.get(user_id)
     return None
 
+@metrics.timed("authenticate_user")
 def authenticate_user(username: str, password: str) -> Optional[models.User]:
     if username in user_credentials and user_credentials[username] == password:
         return get_user_by_username(username)
     return None
 
+@metrics.timed("follow_user")
 def follow_user(follower_id: int, followed_id: int) -> bool:
-    if follower_id not in users or followed_id not in users:
-        return False
-    
-    follows[follower_id].add(followed_id)
+    global follow_edge_count
+
+    with write_lock:
+        if follower_id not in users or followed_id not in users:
+            return False
+        shards = graph
+        if shards is None:
+            if followed_id not in follows[follower_id]:
+                follows[follower_id].add(followed_id)
+                follow_edge_count += 1
+            return True
+
+    if shards.follow_many(follower_id, [followed_id])[0]:
+        with write_lock:
+            follow_edge_count += 1
     return True
 
+@metrics.timed("follow_users")
+def follow_users(follower_id: int, followed_ids: List[int]) -> List[bool]:
+    """Bulk version of follow_user, applied under a single lock acquisition."""
+    global follow_edge_count
+
+    with write_lock:
+        if follower_id not in users:
+            return [False] * len(followed_ids)
+        results = [followed_id in users for followed_id in followed_ids]
+        shards = graph
+        if shards is None:
+            followed_set = follows[follower_id]
+            for followed_id, known in zip(followed_ids, results):
+                if known and followed_id not in followed_set:
+                    followed_set.add(followed_id)
+                    follow_edge_count += 1
+            return results
+
+    added = shards.follow_many(follower_id, [followed_id for followed_id, known in zip(followed_ids, results) if known])
+    with write_lock:
+        follow_edge_count += sum(added)
+    return results
+
+def get_following(user_id: int) -> List[int]:
+    shards = graph
+    if shards is not None:
+        return shards.following(user_id)
+    return list(follows.get(user_id, ()))
+
+@metrics.timed("get_profile")
 def get_profile(user_id: int) -> Optional[models.UserProfile]:
     user = get_user(user_id)
     if not user:
         return None
+
+    shards = graph
+    if shards is not None:
+        counts = shards.profile_counts(user_id)
+        if counts is None:
+            # Not on its shard (yet): same answer as for an unknown user
+            return None
+        post_count, follower_count, following_count = counts
+        return models.UserProfile(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            created_at=user.created_at,
+            post_count=post_count,
+            follower_count=follower_count,
+            following_count=following_count
+        )
     
     # Count posts by this user
-    post_count = sum(1 for post in posts.values() if post.author_id == user_id)
+    post_count = sum(1 for post in list(posts.values()) if post.author_id == user_id)
     
     # Count followers (users who follow this user)
-    follower_count = sum(1 for followed_set in follows.values() if user_id in followed_set)
+    follower_count = sum(1 for followed_set in list(follows.values()) if user_id in followed_set)
     
     # Count following (users this user follows)
     following_count = len(follows.get(user_id, set()))
@@ -146,54 +242,210 @@ def get_profile(user_id: int) -> Optional[models.UserProfile]:
     )
 
 # Post operations
+@metrics.timed("create_post")
 def create_post(post_create: models.PostCreate, author_id: int) -> models.Post:
     global post_id_counter
     
-    author = users[author_id]
+    with write_lock:
+        author = users[author_id]
     
-    post = models.Post(
-        id=post_id_counter,
-        content=post_create.content,
-        author_id=author_id,
-        author_username=author.username,
-        created_at=datetime.now(),
-        likes=0
-    )
-    
-    posts[post.id] = post
-    likes[post.id] = set()  # Initialize empty set of likes
-    
-    post_id_counter += 1
+        post = models.Post(
+            id=post_id_counter,
+            content=post_create.content,
+            author_id=author_id,
+            author_username=author.username,
+            created_at=datetime.now(),
+            likes=0
+        )
+        post_id_counter += 1
+        shards = graph
+        if shards is None:
+            _store_posts([post])
+            return post
+
+    shards.add_posts(author_id, [(post.id, post.created_at)])
+    with write_lock:
+        _store_posts([post])
     return post
 
+@metrics.timed("create_posts")
+def create_posts(post_creates: List[models.PostCreate], author_id: int) -> List[models.Post]:
+    """Bulk version of create_post, applied under a single lock acquisition."""
+    global post_id_counter
+
+    with write_lock:
+        author = users[author_id]
+        created_at = datetime.now()
+
+        created = []
+        for post_create in post_creates:
+            post = models.Post(
+                id=post_id_counter,
+                content=post_create.content,
+                author_id=author_id,
+                author_username=author.username,
+                created_at=created_at,
+                likes=0
+            )
+            post_id_counter += 1
+            created.append(post)
+        shards = graph
+        if shards is None:
+            _store_posts(created)
+            return created
+
+    shards.add_posts(author_id, [(post.id, post.created_at) for post in created])
+    with write_lock:
+        _store_posts(created)
+    return created
+
+def _store_posts(new_posts: List[models.Post]):
+    # Called with write_lock held
+    for post in new_posts:
+        if graph is None:
+            likes[post.id] = set()  # Initialize empty set of likes
+        posts[post.id] = post
+        search.index_post(post)
+        trending.leaderboard.record_post(post.id)
+
 def get_post(post_id: int) -> Optional[models.Post]:
     return posts.get(post_id)
 
+@metrics.timed("like_post")
 def like_post(post_id: int, user_id: int) -> bool:
-    global likes
-    
-    if post_id not in posts or user_id not in users:
-        return False
-    
-    # Add user to the set of users who liked this post
-    if post_id in likes and user_id not in likes[post_id]:
-        likes[post_id].add(user_id)
-        posts[post_id].likes += 1
-    
+    with write_lock:
+        if post_id not in posts or user_id not in users:
+            return False
+        shards = graph
+        if shards is None:
+            # Add user to the set of users who liked this post
+            if post_id in likes and user_id not in likes[post_id]:
+                likes[post_id].add(user_id)
+                _count_like(post_id)
+            return True
+        author_id = posts[post_id].author_id
+
+    if shards.like_many(user_id, [(author_id, post_id)])[0]:
+        with write_lock:
+            _count_like(post_id)
     return True
 
+def _count_like(post_id: int):
+    # Called with write_lock held, for a like that was not recorded yet
+    global like_count
+
+    posts[post_id].likes += 1
+    like_count += 1
+    search.record_like(posts[post_id])
+    trending.leaderboard.record_like(post_id)
+
+@metrics.timed("like_posts")
+def like_posts(post_ids: List[int], user_id: int) -> List[bool]:
+    """Bulk version of like_post, applied under a single lock acquisition."""
+    with write_lock:
+        if user_id not in users:
+            return [False] * len(post_ids)
+        shards = graph
+        if shards is None:
+            results = []
+            for post_id in post_ids:
+                liked_by = likes.get(post_id)
+                if post_id not in posts or liked_by is None:
+                    results.append(False)
+                    continue
+                if user_id not in liked_by:
+                    liked_by.add(user_id)
+                    _count_like(post_id)
+                results.append(True)
+            return results
+        results = [post_id in posts for post_id in post_ids]
+        known = [(posts[post_id].author_id, post_id) for post_id, ok in zip(post_ids, results) if ok]
+
+    added = shards.like_many(user_id, known)
+    with write_lock:
+        for (_, post_id), new in zip(known, added):
+            if new:
+                _count_like(post_id)
+    return results
+
+@metrics.timed("get_feed")
 def get_feed(user_id: int) -> List[models.Post]:
+    shards = graph
+    if shards is not None:
+        if user_id not in users:
+            return []
+        # A post is on its shard slightly before it is in posts
+        return [posts[post_id] for post_id in shards.feed_post_ids(user_id) if post_id in posts]
+
     if user_id not in follows:
         return []
     
     # Get posts from users that this user follows
     followed_users = follows[user_id]
-    feed_posts = [post for post in posts.values() if post.author_id in followed_users]
+    feed_posts = [post for post in list(posts.values()) if post.author_id in followed_users]
     
-    # Sort by creation time (newest first)
-    feed_posts.sort(key=lambda post: post.created_at, reverse=True)
+    # Sort by creation time (newest first). Posts of a batch share their
+    # creation time, the id keeps them newest first too.
+    feed_posts.sort(key=lambda post: (post.created_at, post.id), reverse=True)
     
     return feed_posts
 
+@metrics.timed("search_posts")
+def search_posts(query: str, limit: int = 20) -> List[models.Post]:
+    return search.search(query, posts, limit)
+
+@metrics.timed("get_trending")
+def get_trending(limit: int = 20) -> List[models.Post]:
+    return [posts[post_id] for post_id in trending.leaderboard.top_ids(limit) if post_id in posts]
+
+def enable_sharding(num_shards: int):
+    """Move the social graph to num_shards processes, which then serve get_feed and get_profile.
+
+    The follows and likes are handed over to the shards and dropped from this
+    process; users and posts stay here and are also registered on the shards.
+    """
+    global graph
+
+    with write_lock:
+        if graph is not None:
+            return
+        sharded = sharding.ShardedGraph(num_shards)
+        try:
+            sharded.load(
+                list(users),
+                [(post.author_id, post.id, post.created_at) for post in posts.values()],
+                follows,
+                likes
+            )
+        except BaseException:
+            sharded.close()
+            raise
+        graph = sharded
+        follows.clear()
+        likes.clear()
+
+def disable_sharding():
+    """Bring the follows and likes back from the shards and stop them."""
+    global graph
+
+    with write_lock:
+        if graph is not None:
+            restored_follows, restored_likes = graph.dump()
+            follows.update(restored_follows)
+            likes.update(restored_likes)
+            graph.close()
+            graph = None
+
+def collection_sizes() -> Dict[tuple, int]:
+    """Sizes of the in-memory collections, for the /metrics endpoint. O(1)."""
+    return {
+        (("collection", "users"),): len(users),
+        (("collection", "posts"),): len(posts),
+        (("collection", "follows"),): follow_edge_count,
+        (("collection", "likes"),): like_count,
+    }
+
+metrics.register_gauge("store_collection_size", "Number of users, posts, follow edges and likes in the store.", collection_sizes)
+
 # Initialize the database with sample data
 init_db()
\ No newline at end of file
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+import metrics
+import profiler
+
+# Execution layer for store operations.
+#
+# The API handlers are async but the database functions are synchronous, so
+# calling them directly blocks the event loop for the whole duration of the
+# call. Store work is instead dispatched to bounded thread pools ("lanes").
+# Cheap O(1) operations and expensive scans (get_feed, get_profile) run in
+# separate lanes so that a burst of heavy requests never makes the cheap ones
+# queue behind it.
+
+# Worker threads per lane, configurable through the environment
+LANE_LIMITS: Dict[str, int] = {
+    "light": int(os.environ.get("DB_LIGHT_WORKERS", "4")),
+    "heavy": int(os.environ.get("DB_HEAVY_WORKERS", "2")),
+}
+
+_pools: Dict[str, ThreadPoolExecutor] = {
+    lane: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"db-{lane}")
+    for lane, workers in LANE_LIMITS.items()
+}
+
+
+class EndpointStats:
+    """Queueing counters for a single endpoint."""
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.calls = 0
+        self.queued = 0  # waiting for a worker right now
+        self.running = 0  # executing on a worker right now
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.run_time_total = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "lane": self.lane,
+            "calls": self.calls,
+            "queued": self.queued,
+            "running": self.running,
+            "avg_queue_ms": self.queue_time_total / self.calls * 1000 if self.calls else 0.0,
+            "max_queue_ms": self.queue_time_max * 1000,
+            "avg_run_ms": self.run_time_total / self.calls * 1000 if self.calls else 0.0,
+        }
+
+
+_stats: Dict[str, EndpointStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _get_stats(endpoint: str, lane: str) -> EndpointStats:
+    stats = _stats.get(endpoint)
+    if stats is None:
+        with _stats_lock:
+            stats = _stats.setdefault(endpoint, EndpointStats(lane))
+    return stats
+
+
+async def run(lane: str, endpoint: str, func: Callable[..., Any], *args: Any) -> Any:
+    """Run func(*args) on the worker pool of the given lane and await its result.
+
+    endpoint is only used as the key for the queueing metrics.
+    """
+    pool = _pools[lane]
+    stats = _get_stats(endpoint, lane)
+    submitted = time.perf_counter()
+    state = {"started": False, "abandoned": False}
+    # Worker threads do not inherit the request context, so capture the trace here
+    trace = profiler.current_trace()
+    with _stats_lock:
+        stats.calls += 1
+        stats.queued += 1
+
+    def job():
+        started = time.perf_counter()
+        waited = started - submitted
+        with _stats_lock:
+            if state["abandoned"]:
+                # The caller gave up while the job was queued and already uncounted it
+                return None
+            state["started"] = True
+            stats.queued -= 1
+            stats.running += 1
+            stats.queue_time_total += waited
+            if waited > stats.queue_time_max:
+                stats.queue_time_max = waited
+        start_seq = profiler.request_profiler.sampler.seq
+        try:
+            return func(*args)
+        finally:
+            if trace is not None:
+                profiler.record_job(trace, start_seq)
+            elapsed = time.perf_counter() - started
+            with _stats_lock:
+                stats.running -= 1
+                stats.run_time_total += elapsed
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, job)
+    except asyncio.CancelledError:
+        # Cancelled before a worker picked the job up (e.g. client disconnect):
+        # the job will never run, so it must leave the queue count here
+        with _stats_lock:
+            if not state["started"]:
+                state["abandoned"] = True
+                stats.queued -= 1
+        raise
+
+
+def get_stats() -> Dict[str, Any]:
+    """Snapshot of the lane limits and per-endpoint queueing metrics."""
+    with _stats_lock:
+        endpoints = {endpoint: stats.as_dict() for endpoint, stats in _stats.items()}
+    return {"lanes": dict(LANE_LIMITS), "endpoints": endpoints}
+
+
+def _queue_depths(field: str) -> Dict[tuple, int]:
+    with _stats_lock:
+        return {
+            (("endpoint", endpoint), ("lane", stats.lane)): getattr(stats, field)
+            for endpoint, stats in _stats.items()
+        }
+
+
+metrics.register_gauge("executor_queued_jobs", "Store jobs waiting for a worker, by endpoint.", lambda: _queue_depths("queued"))
+metrics.register_gauge("executor_running_jobs", "Store jobs running on a worker, by endpoint.", lambda: _queue_depths("running"))
+
+
+def shutdown():
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,151 @@
+import asyncio
+import os
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+import metrics
+import models
+
+# Live feed push over server-sent events.
+#
+# Each open /feed/stream connection owns a bounded asyncio.Queue. When a post
+# is created, the API handler publishes it to the subscriptions of the
+# connected users that follow its author. A connection whose buffer is full
+# is a slow consumer: it is evicted instead of letting its backlog grow
+# without bound, and the client is expected to reconnect and reload /feed.
+#
+# Everything here runs on the event loop, so no locking is needed.
+
+BUFFER_SIZE = int(os.environ.get("LIVE_BUFFER_SIZE", "100"))
+KEEPALIVE_SECONDS = float(os.environ.get("LIVE_KEEPALIVE_SECONDS", "15"))
+MAX_STREAMS_PER_USER = int(os.environ.get("LIVE_MAX_STREAMS_PER_USER", "5"))
+
+evictions = metrics.register(metrics.Counter("live_evictions_total", "Live feed streams evicted as slow consumers."))
+
+
+class Subscription:
+    """A single open stream for a user."""
+
+    def __init__(self, user_id: int, buffer_size: int = BUFFER_SIZE):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.evicted = False
+
+    def push(self, post: models.Post) -> bool:
+        """Queue a post without blocking, returns False if the consumer is too slow."""
+        try:
+            self.queue.put_nowait(post)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def evict(self):
+        # Drop the backlog and wake the consumer with the end-of-stream marker
+        self.evicted = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Broker:
+    """Fans new posts out to the subscriptions of the author's followers.
+
+    A reverse index author_id -> subscriptions of connected followers is kept
+    up to date on subscribe, unsubscribe and follow, so publishing a post only
+    touches the streams that receive it, whatever the number of idle streams.
+    """
+
+    def __init__(self):
+        self.subscriptions: Dict[int, Set[Subscription]] = {}  # user_id -> open streams
+        self.by_author: Dict[int, Set[Subscription]] = {}  # author_id -> streams of connected followers
+        self.following: Dict[Subscription, Set[int]] = {}  # stream -> authors it is indexed under
+        self.connections = 0
+
+    def subscribe(self, user_id: int, following: Iterable[int]) -> Optional[Subscription]:
+        """Open a stream, or return None if the user already has MAX_STREAMS_PER_USER."""
+        streams = self.subscriptions.setdefault(user_id, set())
+        if len(streams) >= MAX_STREAMS_PER_USER:
+            return None
+        subscription = Subscription(user_id)
+        streams.add(subscription)
+        authors = set(following)
+        self.following[subscription] = authors
+        for author_id in authors:
+            self.by_author.setdefault(author_id, set()).add(subscription)
+        self.connections += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        authors = self.following.pop(subscription, None)
+        if authors is None:
+            return
+        for author_id in authors:
+            streams = self.by_author.get(author_id)
+            if streams is not None:
+                streams.discard(subscription)
+                if not streams:
+                    del self.by_author[author_id]
+        streams = self.subscriptions.get(subscription.user_id)
+        if streams is not None:
+            streams.discard(subscription)
+            if not streams:
+                del self.subscriptions[subscription.user_id]
+        self.connections -= 1
+
+    def follow(self, follower_id: int, followed_id: int):
+        """Index the open streams of follower_id under a newly followed author."""
+        for subscription in self.subscriptions.get(follower_id, ()):
+            self.following[subscription].add(followed_id)
+            self.by_author.setdefault(followed_id, set()).add(subscription)
+
+    def publish_many(self, posts: List[models.Post]):
+        # Look the recipients up once per author, not once per post
+        by_author: Dict[int, List[models.Post]] = {}
+        for post in posts:
+            by_author.setdefault(post.author_id, []).append(post)
+        for author_id, author_posts in by_author.items():
+            for subscription in list(self.by_author.get(author_id, ())):
+                for post in author_posts:
+                    if not subscription.push(post):
+                        subscription.evict()
+                        self.unsubscribe(subscription)
+                        evictions.inc()
+                        break
+
+    def publish(self, post: models.Post):
+        self.publish_many([post])
+
+    def user_stream_count(self, user_id: int) -> int:
+        return len(self.subscriptions.get(user_id, ()))
+
+    def connection_count(self) -> int:
+        return self.connections
+
+
+broker = Broker()
+
+metrics.register_gauge("live_connections", "Open live feed streams.", lambda: {(): broker.connection_count()})
+
+
+async def event_stream(user_id: int, following: Iterable[int]) -> AsyncIterator[str]:
+    """Server-sent events of new posts for a user, with keep-alive comments while idle.
+
+    following: ids of the users followed by user_id when the stream opens.
+    """
+    subscription = broker.subscribe(user_id, following)
+    if subscription is None:
+        # The handler checks the limit first, this only catches concurrent opens
+        yield "event: rejected\ndata: {\"detail\": \"Too many open streams\"}\n\n"
+        return
+    try:
+        while True:
+            try:
+                post: Optional[models.Post] = await asyncio.wait_for(subscription.queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if post is None:
+                yield "event: evicted\ndata: {}\n\n"
+                return
+            yield f"event: post\nid: {post.id}\ndata: {post.model_dump_json()}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
@@ -1,11 +1,34 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, status, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import List, Any
+from contextlib import asynccontextmanager
 import models
 import database
+import admission
+import executor
+import live
+import metrics
+import profiler
 import logging
+import os
+import time
 
-app = FastAPI(title="Social Media API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shards are started with the server rather than at import, so importing
+    # this module never starts processes
+    shards = int(os.environ.get("GRAPH_SHARDS", "0"))
+    if shards > 0:
+        database.enable_sharding(shards)
+    yield
+    executor.shutdown()
+    database.disable_sharding()
+    if profiler.ENABLED and profiler.DUMP_FILE:
+        profiler.request_profiler.dump(profiler.DUMP_FILE)
+
+
+app = FastAPI(title="Social Media API", lifespan=lifespan)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -16,6 +39,50 @@ handler.setFormatter(logging.Formatter("[%(asctime)s][%(levelname)s]%(message)s"
 request_logger.addHandler(handler)
 request_logger.setLevel(logging.INFO)
 
+def rejection_response(rejection: admission.Rejection) -> JSONResponse:
+    return JSONResponse(
+        status_code=rejection.status_code,
+        content={"detail": rejection.detail},
+        headers={"Retry-After": str(rejection.retry_after)},
+    )
+
+
+async def admit_requests(request: Request, call_next):
+    path = request.url.path
+    if path in admission.EXEMPT_PATHS:
+        return await call_next(request)
+
+    group = admission.controller.endpoint_group(path)
+    # Only a token that names a user gets its own bucket, anything else is
+    # limited by address so random tokens cannot buy a fresh burst
+    auth_header = request.headers.get("Authorization", "")
+    token = auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else None
+    if token is not None and token in database.username_to_id:
+        identity = "user:" + token
+    else:
+        identity = "ip:" + (request.client.host if request.client else "unknown")
+    rejection = admission.controller.check_rate(identity)
+    if rejection:
+        admission.rejections.inc(reason="rate_limit", endpoint=group)
+        return rejection_response(rejection)
+    if path in admission.STREAM_PATHS:
+        return await call_next(request)
+
+    limit, rejection = await admission.controller.acquire(group)
+    if rejection:
+        admission.rejections.inc(reason="overload", endpoint=group)
+        return rejection_response(rejection)
+    try:
+        return await call_next(request)
+    finally:
+        limit.release()
+
+
+# Registered before log_requests so that it runs after it: rejected requests still appear in the logs
+if admission.ENABLED:
+    app.middleware("http")(admit_requests)
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     # Extract method and path
@@ -38,6 +105,40 @@ async def log_requests(request: Request, call_next):
     return response
 
 
+@app.middleware("http")
+async def collect_metrics(request: Request, call_next):
+    method = request.method
+    metrics.http_in_flight.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.http_in_flight.dec()
+        # Use the route template (/like/{post_id}) rather than the raw path to keep label cardinality bounded
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.http_requests.inc(method=method, route=path, status=str(status_code))
+        metrics.http_latency.observe(elapsed, method=method, route=path)
+
+
+async def profile_requests(request: Request, call_next):
+    trace = profiler.request_profiler.begin()
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        profiler.request_profiler.end(trace, request.method, request.url.path, time.perf_counter() - start)
+
+
+# Profiling is opt-in (PROFILE_ENABLED=1), so the middleware is only installed when enabled
+if profiler.ENABLED:
+    app.middleware("http")(profile_requests)
+
+
 # Dependency to get current user
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     user = database.get_user_by_username(token)
@@ -55,7 +156,25 @@ async def get_feed(current_user: models.User = Depends(get_current_user)):
     """
     Get all posts from users that the current user follows
     """
-    return database.get_feed(current_user.id)
+    return await executor.run("heavy", "/feed", database.get_feed, current_user.id)
+
+
+@app.get("/feed/stream")
+async def stream_feed(current_user: models.User = Depends(get_current_user)):
+    """
+    Server-sent events stream of new posts from users that the current user follows
+    """
+    if live.broker.user_stream_count(current_user.id) >= live.MAX_STREAMS_PER_USER:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many open streams",
+        )
+    following = await executor.run("light", "/feed/stream", database.get_following, current_user.id)
+    return StreamingResponse(
+        live.event_stream(current_user.id, following),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/post", response_model=models.Post, status_code=status.HTTP_201_CREATED)
@@ -63,7 +182,9 @@ async def create_post(post: models.PostCreate, current_user: models.User = Depen
     """
     Create a new post
     """
-    return database.create_post(post, current_user.id)
+    created = await executor.run("light", "/post", database.create_post, post, current_user.id)
+    live.broker.publish(created)
+    return created
 
 
 @app.post("/like/{post_id}", status_code=status.HTTP_200_OK)
@@ -71,7 +192,7 @@ async def like_post(post_id: int, current_user: models.User = Depends(get_curren
     """
     Like a post
     """
-    if not database.like_post(post_id, current_user.id):
+    if not await executor.run("light", "/like", database.like_post, post_id, current_user.id):
         raise HTTPException(status_code=404, detail="Post not found")
     return {"message": "Post liked successfully"}
 
@@ -84,18 +205,84 @@ async def follow_user(user_id: int, current_user: models.User = Depends(get_curr
     if current_user.id == user_id:
         raise HTTPException(status_code=400, detail="You cannot follow yourself")
 
-    if not database.follow_user(current_user.id, user_id):
+    if not await executor.run("light", "/follow", database.follow_user, current_user.id, user_id):
         raise HTTPException(status_code=404, detail="User not found")
+    live.broker.follow(current_user.id, user_id)
 
     return {"message": "User followed successfully"}
 
 
+@app.post("/batch/post", response_model=List[models.Post], status_code=status.HTTP_201_CREATED)
+async def create_posts(batch: models.BatchPostCreate, current_user: models.User = Depends(get_current_user)):
+    """
+    Create several posts in a single request
+    """
+    created = await executor.run("heavy", "/batch/post", database.create_posts, batch.posts, current_user.id)
+    live.broker.publish_many(created)
+    return created
+
+
+@app.post("/batch/like", response_model=List[models.BatchItemResult], status_code=status.HTTP_200_OK)
+async def like_posts(batch: models.BatchLike, current_user: models.User = Depends(get_current_user)):
+    """
+    Like several posts in a single request, with one result per post
+    """
+    liked = await executor.run("heavy", "/batch/like", database.like_posts, batch.post_ids, current_user.id)
+    return [
+        models.BatchItemResult(id=post_id, success=success, detail=None if success else "Post not found")
+        for post_id, success in zip(batch.post_ids, liked)
+    ]
+
+
+@app.post("/batch/follow", response_model=List[models.BatchItemResult], status_code=status.HTTP_200_OK)
+async def follow_users(batch: models.BatchFollow, current_user: models.User = Depends(get_current_user)):
+    """
+    Follow several users in a single request, with one result per user
+    """
+    allowed = [user_id for user_id in batch.user_ids if user_id != current_user.id]
+    followed = iter(await executor.run("heavy", "/batch/follow", database.follow_users, current_user.id, allowed))
+
+    results = []
+    for user_id in batch.user_ids:
+        if user_id == current_user.id:
+            results.append(models.BatchItemResult(id=user_id, success=False, detail="You cannot follow yourself"))
+        elif next(followed):
+            live.broker.follow(current_user.id, user_id)
+            results.append(models.BatchItemResult(id=user_id, success=True))
+        else:
+            results.append(models.BatchItemResult(id=user_id, success=False, detail="User not found"))
+    return results
+
+
+@app.get("/search", response_model=List[models.Post])
+async def search_posts(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    Search posts by keywords or hashtags, ranked by likes and recency
+    """
+    return await executor.run("heavy", "/search", database.search_posts, q, limit)
+
+
+@app.get("/trending", response_model=List[models.Post])
+async def get_trending(
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    Get the posts with the most likes, recent likes weighing more
+    """
+    return await executor.run("light", "/trending", database.get_trending, limit)
+
+
 @app.get("/profile/{user_id}", response_model=models.UserProfile)
 async def get_profile(user_id: int, current_user: models.User = Depends(get_current_user)):
     """
     Get user profile
     """
-    profile = database.get_profile(user_id)
+    profile = await executor.run("heavy", "/profile", database.get_profile, user_id)
     if not profile:
         raise HTTPException(status_code=404, detail="User not found")
     return profile
@@ -118,6 +305,45 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"access_token": user.username, "token_type": "bearer"}
 
 
+@app.get("/stats/executor")
+async def executor_stats():
+    """
+    Concurrency limits and per-endpoint queueing metrics of the store workers
+    """
+    return executor.get_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus text exposition of request, latency and store metrics
+    """
+    return metrics.render()
+
+
+async def get_profile_admin(current_user: models.User = Depends(get_current_user)):
+    # Profiles expose source paths and stacks: restricted to PROFILE_ADMINS when set
+    if profiler.ADMINS and current_user.username not in profiler.ADMINS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read profiles")
+    return current_user
+
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def get_profile_samples(admin: models.User = Depends(get_profile_admin)):
+    """
+    Aggregated profile of the sampled requests in folded stack (flame graph) format
+    """
+    return profiler.request_profiler.render_folded()
+
+
+@app.get("/admin/profile/slow")
+async def get_slow_requests(admin: models.User = Depends(get_profile_admin)):
+    """
+    Full profiles captured for requests slower than PROFILE_SLOW_MS
+    """
+    return profiler.request_profiler.get_slow_requests()
+
+
 LOGGING_CONFIG: dict[str, Any] = {
     "version": 1,
     "disable_existing_loggers": False,
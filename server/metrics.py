@@ -0,0 +1,176 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, List, Tuple
+
+# Lightweight Prometheus-style instrumentation.
+#
+# Everything is kept in plain dicts guarded by a lock and rendered in the
+# Prometheus text exposition format on demand, so recording a sample costs a
+# perf_counter() call, a bisect and a couple of integer increments.
+
+def _log_linear_bounds() -> List[float]:
+    """HDR-style bucket upper bounds (seconds) from 10us to 10s.
+
+    Each decade is split into the same set of sub-buckets, giving a constant
+    relative error of roughly one significant digit across the whole range.
+    """
+    bounds = []
+    for exponent in range(-5, 1):
+        for mantissa in (1, 1.5, 2, 3, 5, 7):
+            bounds.append(float(round(mantissa * 10 ** exponent, 7)))
+    bounds.append(10.0)
+    return bounds
+
+
+LATENCY_BUCKETS = _log_linear_bounds()
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Latency histogram with fixed log-linear buckets, one series per label set."""
+
+    def __init__(self, name: str, help_text: str, buckets: List[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: Dict[LabelKey, List] = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, le=repr(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label set."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: Dict[LabelKey, int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = list(self._series.items())
+        for key, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge that can be set directly or computed by a callback at scrape time.
+
+    The callback returns a dict mapping a label dict (as a tuple of pairs) to a value.
+    """
+
+    def __init__(self, name: str, help_text: str, callback: Callable[[], Dict[LabelKey, float]] = None):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self._series: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        if self.callback is not None:
+            snapshot = list(self.callback().items())
+        else:
+            with self._lock:
+                snapshot = list(self._series.items())
+        for key, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(tuple(sorted(key)))} {value}")
+        return lines
+
+
+def _format_labels(key: LabelKey, **extra: str) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Registry of every metric exposed on /metrics, in rendering order
+_registry: Dict[str, object] = {}
+
+
+def register(metric):
+    _registry[metric.name] = metric
+    return metric
+
+
+def register_gauge(name: str, help_text: str, callback: Callable[[], Dict[LabelKey, float]]) -> Gauge:
+    return register(Gauge(name, help_text, callback))
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP layer metrics, fed by the middleware in main.py
+http_requests = register(Counter("http_requests_total", "HTTP requests by method, route and status code."))
+http_latency = register(Histogram("http_request_duration_seconds", "HTTP request latency by method and route."))
+http_in_flight = register(Gauge("http_requests_in_flight", "HTTP requests currently being processed."))
+
+# Store layer metrics, fed by the timed() decorator in database.py
+store_latency = register(Histogram("store_operation_duration_seconds", "Duration of database operations."))
+
+
+def timed(operation: str):
+    """Decorator recording the duration of a store operation in store_latency."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                store_latency.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
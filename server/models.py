@@ -1,5 +1,9 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
+
+# Maximum number of items accepted by the batch endpoints
+MAX_BATCH_SIZE = 1000
 
 class UserBase(BaseModel):
     username: str
@@ -41,4 +45,18 @@ class Post(PostBase):
     likes: int = 0
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class BatchPostCreate(BaseModel):
+    posts: List[PostCreate] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BatchLike(BaseModel):
+    post_ids: List[int] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BatchFollow(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BatchItemResult(BaseModel):
+    id: int
+    success: bool
+    detail: Optional[str] = None
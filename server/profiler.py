@@ -0,0 +1,191 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Opt-in sampling profiler.
+#
+# A background thread snapshots the stacks of every other thread with
+# sys._current_frames() at a fixed interval. Requests only record which
+# threads worked for them and during which samples: the event loop thread for
+# the whole request, and the worker thread of each store job (reported by
+# executor.run). Only those stacks make up the request profile, so the stack
+# walking happens off the request path and concurrent requests running on
+# other workers do not pollute it.
+#
+# Samples are aggregated in the "folded stacks" format understood by
+# flamegraph.pl, speedscope and most flame graph viewers:
+#     root_function;child_function;leaf_function <count>
+
+ENABLED = os.environ.get("PROFILE_ENABLED", "0") == "1"
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.01"))  # fraction of requests aggregated
+SLOW_THRESHOLD = float(os.environ.get("PROFILE_SLOW_MS", "500")) / 1000
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+DUMP_FILE = os.environ.get("PROFILE_DUMP_FILE")
+# Usernames allowed to read the profiles, all authenticated users when empty
+ADMINS = {name for name in os.environ.get("PROFILE_ADMINS", "").split(",") if name}
+
+MAX_SAMPLES = 20000  # recent samples kept in memory for slow request capture
+MAX_SLOW_CAPTURES = 50
+
+# Leaf frames from these modules mean the thread is idle (waiting on a
+# lock, a queue or the selector) and the sample is not interesting
+_IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+
+def _fold(frame) -> Optional[str]:
+    leaf = frame.f_code.co_filename
+    if leaf.endswith(_IDLE_MODULES):
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class Sampler:
+    """Background thread collecting the folded stacks of all other threads.
+
+    Samples are kept in a fixed size ring indexed by sequence number, so the
+    samples of a time window are read directly without scanning the buffer.
+    """
+
+    def __init__(self, interval: float = INTERVAL, max_samples: int = MAX_SAMPLES):
+        self.interval = interval
+        self.seq = 0  # number of samples taken so far
+        self._max_samples = max_samples
+        self._ring: List[Optional[Tuple[int, Dict[int, str]]]] = [None] * max_samples  # (seq, thread_id -> stack)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = {}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = _fold(frame)
+                if stack is not None:
+                    stacks[thread_id] = stack
+            # Single writer: the slot is replaced in one assignment, then published
+            seq = self.seq
+            self._ring[seq % self._max_samples] = (seq, stacks)
+            self.seq = seq + 1
+
+    def stacks_between(self, thread_id: int, start_seq: int, end_seq: int) -> List[str]:
+        """Stacks of one thread in samples [start_seq, end_seq) still held in the ring."""
+        start_seq = max(start_seq, end_seq - self._max_samples)
+        stacks = []
+        for seq in range(start_seq, end_seq):
+            entry = self._ring[seq % self._max_samples]
+            if entry is None or entry[0] != seq:
+                continue
+            stack = entry[1].get(thread_id)
+            if stack is not None:
+                stacks.append(stack)
+        return stacks
+
+
+class RequestTrace:
+    """Threads that worked for a request, with the sample window of each piece of work."""
+
+    def __init__(self, start_seq: int):
+        self.start_seq = start_seq
+        self.loop_thread = threading.get_ident()
+        self.jobs: List[Tuple[int, int, int]] = []  # (thread_id, start_seq, end_seq)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("profiler_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def record_job(trace: RequestTrace, start_seq: int):
+    """Called by a worker thread when it finishes a store job for a traced request."""
+    trace.jobs.append((threading.get_ident(), start_seq, request_profiler.sampler.seq + 1))
+
+
+class Profiler:
+    """Aggregates the samples taken while selected requests are in flight."""
+
+    def __init__(self, sample_rate: float = SAMPLE_RATE, slow_threshold: float = SLOW_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.sampler = Sampler()
+        self.folded: Dict[str, int] = {}
+        self.slow_requests: Deque[Dict[str, Any]] = deque(maxlen=MAX_SLOW_CAPTURES)
+        self._lock = threading.Lock()
+
+    def begin(self) -> RequestTrace:
+        """Start tracing the current request. The trace is visible to executor.run through a context variable."""
+        trace = RequestTrace(self.sampler.seq)
+        _current_trace.set(trace)
+        return trace
+
+    def end(self, trace: RequestTrace, method: str, path: str, elapsed: float):
+        sampled = random.random() < self.sample_rate
+        slow = elapsed >= self.slow_threshold
+        if not sampled and not slow:
+            return
+        # The event loop thread is shared by every coroutine, so its stacks are
+        # kept for the whole request; worker stacks only during this request's jobs
+        end_seq = self.sampler.seq + 1
+        stacks = self.sampler.stacks_between(trace.loop_thread, trace.start_seq, end_seq)
+        for thread_id, start_seq, job_end_seq in list(trace.jobs):
+            stacks.extend(self.sampler.stacks_between(thread_id, start_seq, job_end_seq))
+        counts: Dict[str, int] = {}
+        for stack in stacks:
+            counts[stack] = counts.get(stack, 0) + 1
+        with self._lock:
+            if sampled:
+                for stack, count in counts.items():
+                    self.folded[stack] = self.folded.get(stack, 0) + count
+            if slow:
+                self.slow_requests.append({
+                    "method": method,
+                    "path": path,
+                    "duration_ms": elapsed * 1000,
+                    "finished_at": time.time(),
+                    "folded": counts,
+                })
+
+    def render_folded(self) -> str:
+        with self._lock:
+            items = sorted(self.folded.items(), key=lambda item: item[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def get_slow_requests(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.slow_requests)
+
+    def reset(self):
+        with self._lock:
+            self.folded.clear()
+            self.slow_requests.clear()
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as output:
+            output.write(self.render_folded())
+
+
+request_profiler = Profiler()
+if ENABLED:
+    request_profiler.sampler.start()
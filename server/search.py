@@ -0,0 +1,151 @@
+import heapq
+import re
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Set
+
+import models
+
+# Inverted index over post content.
+#
+# Every token maps to a posting list of post ids stored in a compact
+# array('I') (4 bytes per entry instead of a Python int object). Post ids are
+# allocated in increasing order and posts are indexed as they are created, so
+# posting lists are kept sorted by id, which is also creation order: this
+# allows intersecting them with binary searches and walking them newest first.
+#
+# A query walks at most MAX_SCANNED entries of its rarest token's posting
+# list, and ranking only looks at a bounded candidate set: the newest matches,
+# plus the most liked posts of each query token (kept in a small per-token
+# table that like_post updates), so a popular older post can still be returned.
+
+TOKEN_PATTERN = re.compile(r"#?\w+")
+
+# Newest matches examined per query before ranking (at least 10 per requested
+# result).
+MAX_CANDIDATES = 200
+
+# Entries of the shortest posting list walked per query. This is what bounds
+# the query cost regardless of the number of posts: tokens that are common
+# but rarely appear together stop the walk here, with the matches found so far.
+MAX_SCANNED = 1000
+
+# Most liked posts remembered per token
+TOP_LIKED_PER_TOKEN = 50
+
+_index: Dict[str, array] = {}
+_top_liked: Dict[str, Dict[int, int]] = {}  # token -> {post_id: likes} of its most liked posts
+
+
+def tokenize(text: str) -> Set[str]:
+    """Lowercased word tokens. Hashtags are indexed both with and without the '#'."""
+    tokens = set()
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.add(token)
+        if token.startswith("#") and len(token) > 1:
+            tokens.add(token[1:])
+    return tokens
+
+
+def index_post(post: models.Post):
+    """Add a post to the index. Posts normally arrive in increasing id order,
+    the rare older id (concurrent sharded writes) is inserted in place."""
+    for token in tokenize(post.content):
+        postings = _index.get(token)
+        if postings is None:
+            postings = _index[token] = array("I")
+        if postings and postings[-1] > post.id:
+            postings.insert(bisect_left(postings, post.id), post.id)
+        else:
+            postings.append(post.id)
+
+
+def record_like(post: models.Post):
+    """Update the most liked tables of the post's tokens after a like."""
+    for token in tokenize(post.content):
+        top = _top_liked.setdefault(token, {})
+        if post.id in top or len(top) < TOP_LIKED_PER_TOKEN:
+            top[post.id] = post.likes
+            continue
+        least = min(top, key=top.get)
+        if post.likes > top[least]:
+            del top[least]
+            top[post.id] = post.likes
+
+
+def _contains(postings: array, post_id: int) -> bool:
+    position = bisect_left(postings, post_id)
+    return position < len(postings) and postings[position] == post_id
+
+
+def _most_liked_ids(tokens: Set[str]) -> List[int]:
+    """Ids of the most liked posts of any query token that contain every token."""
+    lists = [_index[token] for token in tokens]
+    ids = set()
+    for token in tokens:
+        ids.update(_top_liked.get(token, ()))
+    return [post_id for post_id in ids if all(_contains(postings, post_id) for postings in lists)]
+
+
+def _matching_ids(tokens: Iterable[str], max_candidates: int, max_scanned: int = MAX_SCANNED) -> List[int]:
+    """Ids of the posts containing every token, newest first, at most max_candidates.
+
+    Only the newest max_scanned entries of the shortest posting list are
+    looked at, so older matches of rarely co-occurring tokens can be missed.
+    """
+    lists = []
+    for token in tokens:
+        postings = _index.get(token)
+        if postings is None:
+            return []
+        lists.append(postings)
+    if not lists:
+        return []
+
+    # Walk the newest part of the shortest posting list and binary search the
+    # others. Ids only decrease, so each search is bounded by the previous hit
+    # above and by the oldest id walked below.
+    lists.sort(key=len)
+    shortest, others = lists[0], lists[1:]
+    walked = shortest[max(len(shortest) - max_scanned, 0):]
+    if not walked:
+        return []
+    lows = [bisect_left(postings, walked[0]) for postings in others]
+    bounds = [len(postings) for postings in others]
+    matches = []
+    for post_id in reversed(walked):
+        for i, postings in enumerate(others):
+            position = bisect_left(postings, post_id, lows[i], bounds[i])
+            bounds[i] = position
+            if position == len(postings) or postings[position] != post_id:
+                break
+        else:
+            matches.append(post_id)
+            if len(matches) >= max_candidates:
+                break
+    return matches
+
+
+def _score(post: models.Post, now: float) -> float:
+    # Likes count for more than recency, but their weight decays with age
+    age_hours = max(now - post.created_at.timestamp(), 0) / 3600
+    return (post.likes + 1) / (age_hours + 2) ** 1.5
+
+
+def search(query: str, posts: Dict[int, models.Post], limit: int = 20) -> List[models.Post]:
+    """Posts containing every token of the query, ranked by likes and recency.
+
+    The result is approximate: only the newest MAX_SCANNED posts containing
+    the query's rarest token are checked for the other tokens, and only the
+    newest max(MAX_CANDIDATES, 10 * limit) matches plus the TOP_LIKED_PER_TOKEN
+    most liked posts of each token are scored. An older post with few likes
+    may be missing for common tokens.
+    """
+    tokens = tokenize(query)
+    ids = set(_matching_ids(tokens, max(MAX_CANDIDATES, 10 * limit)))
+    if ids:
+        ids.update(_most_liked_ids(tokens))
+    candidates = [posts[post_id] for post_id in ids if post_id in posts]
+    now = time.time()
+    return heapq.nlargest(limit, candidates, key=lambda post: (_score(post, now), post.id))
@@ -0,0 +1,351 @@
+import heapq
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Hash-partitioned social graph spread over local shard processes.
+#
+# Users are assigned to a shard by a hash of their id. A shard owns, for each
+# of its users:
+# - following: ids of the users they follow,
+# - followers: ids of the users following them (the reverse edges are stored
+#   on the followed user's shard so follower counts are a single lookup),
+# - the ids and creation times of their posts,
+# - for each of their posts, the ids of the users who liked it.
+# All of these are sorted array('I') / array('q') columns instead of Python
+# sets, which keeps them compact. While sharding is enabled the shards are the
+# only copy of the follow edges and likes: the API process only keeps the
+# users, the posts and running totals.
+#
+# Queries spanning several users are scatter-gather: the request is sent to
+# every shard involved before any reply is read, so the shards work in parallel.
+#
+# Shards are started as `python sharding.py <address>` rather than with
+# multiprocessing: its spawn and forkserver start methods re-import the
+# parent's __main__ in the child, which for the API would mean loading
+# FastAPI, the sample data and the worker pools once per shard. This module
+# only depends on the standard library, so a shard process stays small.
+
+# Seconds a new shard process has to connect back before startup fails
+CONNECT_TIMEOUT = float(os.environ.get("GRAPH_SHARD_CONNECT_TIMEOUT", "10"))
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_micros(created_at: datetime) -> int:
+    """Exact integer timestamp, so ordering ties are the same as with datetimes."""
+    return (created_at.replace(tzinfo=None) - _EPOCH) // _MICROSECOND
+
+
+def _insert_sorted(column: array, value: int) -> bool:
+    position = bisect_left(column, value)
+    if position < len(column) and column[position] == value:
+        return False
+    column.insert(position, value)
+    return True
+
+
+class ShardState:
+    """Data owned by one shard process. Every public method is a message handler."""
+
+    def __init__(self):
+        self.following: Dict[int, array] = {}
+        self.followers: Dict[int, array] = {}
+        self.post_ids: Dict[int, array] = {}  # author_id -> post ids, in creation order
+        self.post_times: Dict[int, array] = {}  # author_id -> creation times in microseconds
+        self.likers: Dict[int, array] = {}  # post_id -> ids of the users who liked it
+
+    def add_user(self, user_id: int):
+        self.following.setdefault(user_id, array("I"))
+        self.followers.setdefault(user_id, array("I"))
+        self.post_ids.setdefault(user_id, array("I"))
+        self.post_times.setdefault(user_id, array("q"))
+
+    def add_posts(self, author_id: int, posts: List[Tuple[int, int]]):
+        """posts: (post_id, created_at) of new posts of author_id."""
+        ids = self.post_ids[author_id]
+        times = self.post_times[author_id]
+        for post_id, created_at in posts:
+            ids.append(post_id)
+            times.append(created_at)
+            self.likers[post_id] = array("I")
+
+    def add_edges(self, following: List[Tuple[int, int]], followers: List[Tuple[int, int]]) -> List[bool]:
+        """Store the (follower_id, followed_id) and (followed_id, follower_id) edges owned here.
+
+        Returns for each following edge whether it is new.
+        """
+        for followed_id, follower_id in followers:
+            _insert_sorted(self.followers[followed_id], follower_id)
+        return [_insert_sorted(self.following[follower_id], followed_id) for follower_id, followed_id in following]
+
+    def add_likes(self, likes: List[Tuple[int, int]]) -> List[bool]:
+        """Store (post_id, user_id) likes, returns for each one whether it is new."""
+        return [_insert_sorted(self.likers[post_id], user_id) for post_id, user_id in likes]
+
+    def load(self, user_ids: List[int], posts: List[Tuple[int, int, int]], following: List[Tuple[int, int]], followers: List[Tuple[int, int]], likes: List[Tuple[int, int]]):
+        for user_id in user_ids:
+            self.add_user(user_id)
+        for author_id, post_id, created_at in posts:
+            self.add_posts(author_id, [(post_id, created_at)])
+        self.add_edges(following, followers)
+        self.add_likes(likes)
+
+    def dump(self) -> Tuple[Dict[int, List[int]], Dict[int, List[int]]]:
+        """Follow edges and likes owned here, as {user_id: followed ids} and {post_id: liker ids}."""
+        return (
+            {user_id: list(followed) for user_id, followed in self.following.items()},
+            {post_id: list(liked_by) for post_id, liked_by in self.likers.items()},
+        )
+
+    def get_following(self, user_id: int) -> Optional[List[int]]:
+        following = self.following.get(user_id)
+        return None if following is None else list(following)
+
+    def posts_by(self, author_ids: List[int]) -> List[Tuple[int, int]]:
+        """(-created_at, -post_id) of every post of the given authors, newest first."""
+        entries = []
+        for author_id in author_ids:
+            ids = self.post_ids.get(author_id)
+            if ids:
+                entries.extend(zip([-created_at for created_at in self.post_times[author_id]], [-post_id for post_id in ids]))
+        entries.sort()
+        return entries
+
+    def profile_counts(self, user_id: int):
+        """(post_count, follower_count, following_count), or None for an unknown user."""
+        if user_id not in self.following:
+            return None
+        return len(self.post_ids[user_id]), len(self.followers[user_id]), len(self.following[user_id])
+
+
+def _shard_main(connection):
+    """Message loop of a shard process, until the parent closes the connection."""
+    state = ShardState()
+    while True:
+        try:
+            operation, args = connection.recv()
+        except EOFError:
+            break
+        if operation == "close":
+            break
+        try:
+            connection.send((True, getattr(state, operation)(*args)))
+        except Exception as e:  # reported to the caller instead of killing the shard
+            connection.send((False, e))
+    connection.close()
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+class ShardedGraph:
+    """Client side of the shard processes, safe to use from several threads."""
+
+    def __init__(self, num_shards: int):
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.num_shards = num_shards
+        self._connections = []
+        self._processes: List[subprocess.Popen] = []
+        self._locks = [threading.Lock() for _ in range(num_shards)]
+        try:
+            for _ in range(num_shards):
+                self._start_shard()
+        except BaseException:
+            self.close()
+            raise
+
+    def _start_shard(self):
+        # The shard connects back to a private listener, authenticated with a
+        # random key sent on its stdin so it never shows up in the process list
+        authkey = secrets.token_bytes(32)
+        with Listener(authkey=authkey) as listener:
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), str(listener.address)],
+                stdin=subprocess.PIPE,
+            )
+            self._processes.append(process)
+            try:
+                process.stdin.write(authkey.hex().encode() + b"\n")
+                process.stdin.close()
+            except OSError:
+                pass  # already dead, reported below
+            # Listener.accept has no timeout: it runs on a helper thread while
+            # this one watches the process and the deadline
+            accepted = []
+            acceptor = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+            acceptor.start()
+            deadline = time.monotonic() + CONNECT_TIMEOUT
+            while acceptor.is_alive() and process.poll() is None and time.monotonic() < deadline:
+                acceptor.join(0.05)
+            acceptor.join(0.05)
+            if not accepted:
+                # The shard is killed, the daemon helper thread is left blocked
+                process.kill()
+                raise ShardError(f"Shard process did not connect back (exit code {process.wait()})")
+            self._connections.append(accepted[0])
+
+    def shard_of(self, user_id: int) -> int:
+        # Multiplicative hash so that sequential ids are spread over all shards
+        return (user_id * 2654435761 & 0xFFFFFFFF) % self.num_shards
+
+    @staticmethod
+    def _result(reply) -> Any:
+        ok, value = reply
+        if not ok:
+            raise ShardError(f"Shard operation failed: {value!r}")
+        return value
+
+    def _call(self, shard: int, operation: str, *args) -> Any:
+        with self._locks[shard]:
+            try:
+                self._connections[shard].send((operation, args))
+                reply = self._connections[shard].recv()
+            except (OSError, EOFError) as e:
+                raise ShardError(f"Shard {shard} unavailable: {e!r}") from e
+        return self._result(reply)
+
+    def _scatter(self, requests: Dict[int, Tuple[str, tuple]]) -> Dict[int, Any]:
+        """Send one request per shard, then gather all the replies."""
+        shards = sorted(requests)  # fixed lock order, so concurrent scatters cannot deadlock
+        for shard in shards:
+            self._locks[shard].acquire()
+        error = None
+        replies = {}
+        try:
+            sent = []
+            for shard in shards:
+                try:
+                    self._connections[shard].send(requests[shard])
+                except (OSError, EOFError) as e:
+                    error = e
+                    break
+                sent.append(shard)
+            # Every reply owed is read even after a failure, so that no
+            # connection is left answering the wrong request
+            for shard in sent:
+                try:
+                    replies[shard] = self._connections[shard].recv()
+                except (OSError, EOFError) as e:
+                    error = e
+        finally:
+            for shard in shards:
+                self._locks[shard].release()
+        if error is not None:
+            raise ShardError(f"Shard unavailable: {error!r}") from error
+        return {shard: self._result(reply) for shard, reply in replies.items()}
+
+    def _group(self, user_ids: Iterable[int]) -> Dict[int, List[int]]:
+        groups: Dict[int, List[int]] = {}
+        for user_id in user_ids:
+            groups.setdefault(self.shard_of(user_id), []).append(user_id)
+        return groups
+
+    # Writes
+
+    def load(self, user_ids: Iterable[int], posts: Iterable[Tuple[int, int, datetime]], follows: Dict[int, Iterable[int]], likes: Dict[int, Iterable[int]]):
+        """Bulk load existing data, one message per shard."""
+        batches = {shard: ([], [], [], [], []) for shard in range(self.num_shards)}
+        for user_id in user_ids:
+            batches[self.shard_of(user_id)][0].append(user_id)
+        author_of = {}
+        for author_id, post_id, created_at in posts:
+            batches[self.shard_of(author_id)][1].append((author_id, post_id, to_micros(created_at)))
+            author_of[post_id] = author_id
+        for follower_id, followed_ids in follows.items():
+            for followed_id in followed_ids:
+                batches[self.shard_of(follower_id)][2].append((follower_id, followed_id))
+                batches[self.shard_of(followed_id)][3].append((followed_id, follower_id))
+        for post_id, user_ids in likes.items():
+            batch = batches[self.shard_of(author_of[post_id])][4]
+            batch.extend((post_id, user_id) for user_id in user_ids)
+        self._scatter({shard: ("load", batch) for shard, batch in batches.items()})
+
+    def dump(self) -> Tuple[Dict[int, Set[int]], Dict[int, Set[int]]]:
+        """All follow edges and likes, as {user_id: followed ids} and {post_id: liker ids}."""
+        follows: Dict[int, Set[int]] = {}
+        likes: Dict[int, Set[int]] = {}
+        for shard_follows, shard_likes in self._scatter({shard: ("dump", ()) for shard in range(self.num_shards)}).values():
+            follows.update((user_id, set(followed)) for user_id, followed in shard_follows.items())
+            likes.update((post_id, set(liked_by)) for post_id, liked_by in shard_likes.items())
+        return follows, likes
+
+    def add_user(self, user_id: int):
+        self._call(self.shard_of(user_id), "add_user", user_id)
+
+    def add_posts(self, author_id: int, posts: Iterable[Tuple[int, datetime]]):
+        """posts: (post_id, created_at) of new posts of author_id."""
+        entries = [(post_id, to_micros(created_at)) for post_id, created_at in posts]
+        self._call(self.shard_of(author_id), "add_posts", author_id, entries)
+
+    def follow_many(self, follower_id: int, followed_ids: List[int]) -> List[bool]:
+        """Add follow edges, returns for each one whether it is new."""
+        follower_shard = self.shard_of(follower_id)
+        batches = {follower_shard: ([(follower_id, followed_id) for followed_id in followed_ids], [])}
+        for followed_id in followed_ids:
+            batches.setdefault(self.shard_of(followed_id), ([], []))[1].append((followed_id, follower_id))
+        # The reverse edges are sent along in the same scatter, one message per shard
+        return self._scatter({shard: ("add_edges", batch) for shard, batch in batches.items()})[follower_shard]
+
+    def like_many(self, user_id: int, posts: List[Tuple[int, int]]) -> List[bool]:
+        """posts: (author_id, post_id) liked by user_id. Returns for each like whether it is new."""
+        positions: Dict[int, List[int]] = {}
+        batches: Dict[int, List[Tuple[int, int]]] = {}
+        for position, (author_id, post_id) in enumerate(posts):
+            shard = self.shard_of(author_id)
+            positions.setdefault(shard, []).append(position)
+            batches.setdefault(shard, []).append((post_id, user_id))
+        replies = self._scatter({shard: ("add_likes", (batch,)) for shard, batch in batches.items()})
+        results = [False] * len(posts)
+        for shard, shard_positions in positions.items():
+            for position, new in zip(shard_positions, replies[shard]):
+                results[position] = new
+        return results
+
+    # Queries
+
+    def following(self, user_id: int) -> List[int]:
+        return self._call(self.shard_of(user_id), "get_following", user_id) or []
+
+    def feed_post_ids(self, user_id: int) -> List[int]:
+        """Ids of the posts of the users followed by user_id, newest first."""
+        following = self._call(self.shard_of(user_id), "get_following", user_id)
+        if not following:
+            return []
+        groups = self._group(following)
+        replies = self._scatter({shard: ("posts_by", (author_ids,)) for shard, author_ids in groups.items()})
+        # Each shard answers sorted by (-created_at, -post_id): a k-way merge keeps that order
+        return [-post_id for _, post_id in heapq.merge(*replies.values())]
+
+    def profile_counts(self, user_id: int):
+        """(post_count, follower_count, following_count), or None for an unknown user."""
+        return self._call(self.shard_of(user_id), "profile_counts", user_id)
+
+    def close(self):
+        for shard, connection in enumerate(self._connections):
+            with self._locks[shard]:
+                try:
+                    connection.send(("close", ()))
+                except (OSError, EOFError):
+                    pass
+                connection.close()
+        for process in self._processes:
+            try:
+                process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    _shard_main(Client(sys.argv[1], authkey=bytes.fromhex(sys.stdin.readline().strip())))
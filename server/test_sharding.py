@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+import database
+import models
+
+# get_feed and get_profile must answer with sharding on what the single
+# process store answers, for data loaded when sharding is enabled and for
+# writes made afterwards. The expected answers come from reference sets of
+# follow edges and likes kept by the test itself, never from the shards.
+#
+# Run from the server directory: python -m pytest test_sharding.py
+
+NUM_SHARDS = 3
+
+# Copied at import, before any test enables sharding, then updated by every
+# write the tests make
+reference_follows = {user_id: set(followed) for user_id, followed in database.follows.items()}
+reference_likes = {post_id: set(liked_by) for post_id, liked_by in database.likes.items()}
+
+
+def create_user(name):
+    user = database.create_user(models.UserCreate(username=name, email="test@example.com", password="password"))
+    reference_follows[user.id] = set()
+    return user
+
+
+def create_posts(count, author_id):
+    created = database.create_posts([models.PostCreate(content="batch #shard")] * count, author_id)
+    for post in created:
+        reference_likes[post.id] = set()
+    return created
+
+
+def follow(follower_id, followed_ids):
+    results = database.follow_users(follower_id, followed_ids)
+    expected = [followed_id in reference_follows for followed_id in followed_ids]
+    assert results == expected
+    for followed_id, ok in zip(followed_ids, results):
+        if ok:
+            reference_follows[follower_id].add(followed_id)
+
+
+def like(user_id, post_ids):
+    results = database.like_posts(post_ids, user_id)
+    expected = [post_id in reference_likes for post_id in post_ids]
+    assert results == expected
+    for post_id, ok in zip(post_ids, results):
+        if ok:
+            reference_likes[post_id].add(user_id)
+
+
+def random_writes(rng, user_ids, count):
+    for i in range(count):
+        post = database.create_post(models.PostCreate(content=f"post {i} #shard"), rng.choice(user_ids))
+        reference_likes[post.id] = set()
+        follower_id, followed_id = rng.choice(user_ids), rng.choice(user_ids)
+        assert database.follow_user(follower_id, followed_id)
+        reference_follows[follower_id].add(followed_id)
+        post_id, user_id = rng.choice(list(reference_likes)), rng.choice(user_ids)
+        assert database.like_post(post_id, user_id)
+        reference_likes[post_id].add(user_id)
+
+
+def check_against_reference(user_ids):
+    for user_id in user_ids:
+        followed = reference_follows[user_id]
+        expected_feed = [post for post in database.posts.values() if post.author_id in followed]
+        expected_feed.sort(key=lambda post: (post.created_at, post.id), reverse=True)
+        assert [post.id for post in database.get_feed(user_id)] == [post.id for post in expected_feed]
+
+        profile = database.get_profile(user_id)
+        assert profile.post_count == sum(1 for post in database.posts.values() if post.author_id == user_id)
+        assert profile.follower_count == sum(1 for followed_ids in reference_follows.values() if user_id in followed_ids)
+        assert profile.following_count == len(followed)
+
+    assert database.get_profile(max(user_ids) + 1000) is None
+    assert {post_id: post.likes for post_id, post in database.posts.items()} == {post_id: len(liked_by) for post_id, liked_by in reference_likes.items()}
+    sizes = database.collection_sizes()
+    assert sizes[(("collection", "follows"),)] == sum(map(len, reference_follows.values()))
+    assert sizes[(("collection", "likes"),)] == sum(map(len, reference_likes.values()))
+
+
+@pytest.fixture
+def user_ids():
+    rng = random.Random(42)
+    start = len(database.users)
+    for i in range(100):
+        create_user(f"shard_test_{start + i}")
+    ids = list(database.users)
+    random_writes(rng, ids, 1000)
+    yield ids
+    database.disable_sharding()
+
+
+def test_loaded_data_is_served_the_same(user_ids):
+    check_against_reference(user_ids)
+
+    database.enable_sharding(NUM_SHARDS)
+
+    assert not database.follows and not database.likes
+    check_against_reference(user_ids)
+
+
+def test_writes_after_enabling_are_served_the_same(user_ids):
+    rng = random.Random(7)
+    database.enable_sharding(NUM_SHARDS)
+
+    random_writes(rng, user_ids, 300)
+    follow(user_ids[0], user_ids[:50] + [max(user_ids) + 1000, user_ids[0], user_ids[1]])
+    like(user_ids[1], list(database.posts)[:50] + [max(database.posts) + 1000, 1])
+    create_posts(20, user_ids[2])
+    late = create_user(f"shard_test_late_{len(user_ids)}")
+    follow(late.id, [user_ids[2]])
+    user_ids = user_ids + [late.id]
+    check_against_reference(user_ids)
+
+    # The store brought back in process must hold the same graph
+    database.disable_sharding()
+    check_against_reference(user_ids)
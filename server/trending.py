@@ -0,0 +1,78 @@
+import math
+import os
+import time
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+# Incrementally maintained leaderboard of posts ranked by time-decayed likes.
+#
+# A like at time t is worth 2 ** (-(now - t) / HALF_LIFE_SECONDS) at time now.
+# Instead of decaying every score as time passes, each event adds
+# 2 ** ((t - base_time) / HALF_LIFE_SECONDS): all scores share the same
+# implicit factor 2 ** (-(now - base_time) / HALF_LIFE_SECONDS), so their
+# order is already the decayed order. The weights grow over time, so the
+# scores are periodically rebased on a newer base_time to keep them far from
+# float overflow.
+#
+# Since scores only ever increase, the leaderboard only has to track the
+# CAPACITY best posts in a sorted list: a post outside of it can only enter
+# when it is liked, at which point its score is compared with the minimum.
+
+HALF_LIFE_SECONDS = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", "6")) * 3600
+CAPACITY = 1000
+CREATE_WEIGHT = 1.0  # a new post counts as one like so fresh posts can trend
+REBASE_AFTER = 50.0  # rebase when weights reach exp(50)
+
+_scale = HALF_LIFE_SECONDS / math.log(2)
+
+
+class Leaderboard:
+    def __init__(self, capacity: int = CAPACITY, clock=time.time):
+        self.capacity = capacity
+        self.clock = clock
+        self.base_time = clock()
+        self.scores: Dict[int, float] = {}  # post_id -> score of every known post
+        self.top: List[Tuple[float, int]] = []  # (score, post_id) of the best posts, ascending
+
+    def _weight(self) -> float:
+        exponent = (self.clock() - self.base_time) / _scale
+        if exponent > REBASE_AFTER:
+            self._rebase()
+            exponent = 0.0
+        return math.exp(exponent)
+
+    def _rebase(self):
+        now = self.clock()
+        factor = math.exp(-(now - self.base_time) / _scale)
+        self.scores = {post_id: score * factor for post_id, score in self.scores.items()}
+        # Scaling preserves the order, so the list stays sorted
+        self.top = [(score * factor, post_id) for score, post_id in self.top]
+        self.base_time = now
+
+    def _add(self, post_id: int, amount: float):
+        old = self.scores.get(post_id, 0.0)
+        new = old + amount
+        self.scores[post_id] = new
+
+        position = bisect_left(self.top, (old, post_id))
+        if position < len(self.top) and self.top[position] == (old, post_id):
+            del self.top[position]
+        elif len(self.top) >= self.capacity and new <= self.top[0][0]:
+            return
+        insort(self.top, (new, post_id))
+        if len(self.top) > self.capacity:
+            del self.top[0]
+
+    def record_post(self, post_id: int):
+        self._add(post_id, CREATE_WEIGHT * self._weight())
+
+    def record_like(self, post_id: int):
+        self._add(post_id, self._weight())
+
+    def top_ids(self, limit: int) -> List[int]:
+        """Ids of the limit best posts, best first, in O(limit)."""
+        top = self.top
+        return [post_id for _, post_id in top[:-limit - 1:-1]] if limit > 0 else []
+
+
+leaderboard = Leaderboard()